@@ -1,8 +1,36 @@
 import streamlit as st
 import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
 import requests
-import base64
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
+import binascii
+import hashlib
+import itertools
+import json
 import os
+import random
+import re
+import shelve
+import string
+import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    # Optional: SIMD-accelerated base64 decoding for large lock files
+    import pybase64
+except ImportError:
+    pybase64 = None
+
+try:
+    # Optional: incremental JSON parsing for very large repository trees
+    import ijson
+except ImportError:
+    ijson = None
 
 # --- CONFIGURATION ---
 st.set_page_config(page_title="GitGrade - AI Repo Analyzer", layout="wide")
@@ -11,20 +39,251 @@ st.title("GitGrade: AI-Powered Repository Analyzer 🚀")
 st.markdown("### Unfold Success from Untold Experiences")
 st.markdown("Evaluate your GitHub repository and get a **Score, Summary, and Personalized Roadmap.**")
 
+# Cap on simultaneous GitHub requests (shared by all sessions) to stay clear of secondary rate limits
+GITHUB_MAX_WORKERS = 8
+GITHUB_MAX_CONCURRENT_REQUESTS = 5
+
+# (connect, read) timeout for every GitHub request, so a hung connection can't pin a shared worker
+GITHUB_TIMEOUT = (5, 30)
+
+# Rate-limited GitHub responses are retried after the advertised wait, unless it exceeds the max wait.
+# The workers are shared by every session, so longer waits fail fast rather than stall other users.
+GITHUB_RATE_LIMIT_RETRIES = 3
+GITHUB_RATE_LIMIT_MAX_WAIT = 5
+
+# Offered without a list_models() round trip when the key can reach the first (default) model
+PREFERRED_MODELS = ["models/gemini-2.5-flash", "models/gemini-1.5-flash", "models/gemini-1.5-pro"]
+
+# Per-file caps applied right after fetching, and the total dependency budget sent to Gemini
+README_MAX_BYTES = 20_000
+DEPENDENCY_FILE_MAX_BYTES = 40_000
+DEPENDENCY_BYTE_BUDGET = 60_000
+
+# Metadata fields the evaluation actually uses; the rest of the API payload is noise
+METADATA_FIELDS = [
+    "name", "description", "language", "stargazers_count", "forks_count", "open_issues_count",
+    "license", "default_branch", "pushed_at", "created_at", "topics"
+]
+
+# Number of tree paths shown to Gemini as the file structure
+STRUCTURE_MAX_FILES = 100
+
+# Base64 payloads above this size go through pybase64 when it is installed
+PYBASE64_MIN_BYTES = 256 * 1024
+
+# Repos up to this size (GitHub reports KB) are fetched as one tarball instead of per-file blobs
+TARBALL_MAX_REPO_KB = 1024
+
+DEPENDENCY_FILES = ["requirements.txt", "package.json", "Pipfile", "pyproject.toml", "package-lock.json", "Pipfile.lock", "yarn.lock"]
+TRUNCATION_MARKER = "\n...[truncated]..."
+
+LOCK_FILES = ["package-lock.json", "Pipfile.lock", "yarn.lock"]
+REPO_FILES = ["README.md"] + DEPENDENCY_FILES
+
+# Static instructions, sent once as the model's system instruction rather than in every prompt
+SYSTEM_INSTRUCTION = """
+    You are a strict Senior Developer Mentor acting as an AI engine for "GitGrade".
+    Your task is to evaluate a GitHub repository based on the inputs provided by the user:
+    Repository Metadata, File Structure, README Content, and Dependency Files Content.
+
+    **Evaluation Criteria:**
+    - **Code Quality & Organization:** Look for clean folder structures (src, tests, docs), separation of concerns.
+    - **Documentation:** Is the README clear? Does it have setup instructions?
+    - **Best Practices:** Presence of .gitignore, LICENSE, CI/CD workflows, test folders.
+    - **Dependency Health (CRITICAL):** Analyze the provided dependency content (or lack thereof) for:
+        a) **Security Risk:** Are common packages severely outdated? (Infer potential CVEs if versions are very old).
+        b) **Maintainability:** Is a lock file (e.g., package-lock.json, Pipfile.lock) present? (Crucial for reproducible builds).
+        c) **Clarity:** Are dependencies specified without version pinning? (Bad practice).
+
+    **Output Requirement:**
+    Provide the response in the following specific format:
+
+    ### SCORE
+    [Provide a score out of 100 based on the quality. Be honest and critical.]
+
+    ### CRITICAL INSIGHTS
+    [A 2-3 sentence section dedicated ONLY to Dependency Health and Security Risk. Be direct.]
+
+    ### SUMMARY
+    [A short paragraph (approx 50 words) evaluating the strengths and weaknesses of the overall project, including the Dependency Health findings.]
+
+    ### ROADMAP
+    [Bulleted list of 3-5 actionable steps the student must take to improve this project. Include at least two specific actions related to Dependency Health (e.g., pinning versions, adding a lock file, or updating a specific package).]
+    
+    Do not be polite just for the sake of it. Give honest, constructive feedback.
+    """
+
+# Per-repo prompt; only the repository inputs are substituted on each call
+PROMPT_TEMPLATE = string.Template("""
+    Evaluate the following GitHub repository:
+    
+    1. **Repository Metadata**: $metadata
+    2. **File Structure**: 
+    $structure
+    3. **README Content**: 
+    $readme
+    4. **Dependency Files Content**:
+    $deps
+    """
+)
+
+# On-disk caches that survive app restarts (Gemini responses, GitHub ETags and blobs)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".gitgrade_cache")
+# Entries expire after a week, and each store is pruned once it holds more than this many entries
+DISK_CACHE_TTL = 7 * 24 * 60 * 60
+DISK_CACHE_MAX_ENTRIES = 500
+
 # --- HELPER FUNCTIONS ---
 
-def get_available_models(api_key):
-    """Fetches available models that support content generation."""
+@st.cache_resource
+def get_github_session():
+    """Returns a pooled HTTP session shared across reruns (keep-alive + retries)."""
+    session = requests.Session()
+    # raise_on_status=False hands the final 5xx back to the callers' status-code handling instead of raising
+    retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], raise_on_status=False)
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20, max_retries=retries))
+    session.headers.update({"Accept": "application/vnd.github+json"})
+    return session
+
+@st.cache_resource
+def get_github_executor():
+    """Returns a worker pool shared across reruns and sessions for concurrent GitHub fetches."""
+    return ThreadPoolExecutor(max_workers=GITHUB_MAX_WORKERS, thread_name_prefix="github")
+
+@st.cache_resource
+def get_github_semaphore():
+    """Limits in-flight GitHub requests across all sessions."""
+    return threading.Semaphore(GITHUB_MAX_CONCURRENT_REQUESTS)
+
+def rate_limit_wait(response, attempt):
+    """Returns the seconds to wait before retrying a rate-limited response, or None if it is not rate limited."""
+    retry_after = response.headers.get("Retry-After")
+    remaining = response.headers.get("X-RateLimit-Remaining")
+    if response.status_code == 429 or (response.status_code == 403 and (retry_after or remaining == "0")):
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining == "0" and reset and reset.isdigit():
+            return max(int(reset) - int(time.time()), 0)
+        return 2 ** attempt
+    return None
+
+def acquire_github_response(url, headers, stream):
+    """GETs url under the shared semaphore; a streamed response keeps its slot until it is closed."""
+    semaphore = get_github_semaphore()
+    semaphore.acquire()
+    try:
+        response = get_github_session().get(url, headers=headers, stream=stream, timeout=GITHUB_TIMEOUT)
+    except BaseException:
+        semaphore.release()
+        raise
+    if not stream:
+        # The body is already read, so the connection is free again
+        semaphore.release()
+        return response
+
+    # Streamed bodies (tarball, recursive tree) are still downloading, so release only once the caller closes
+    close = response.close
+    released = threading.Event()
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released.is_set():
+                released.set()
+                semaphore.release()
+    response.close = close_and_release
+    return response
+
+def github_get(url, token=None, stream=False, headers=None):
+    """GET against the GitHub API over the shared session, backing off when rate limited."""
+    headers = dict(headers or {})
+    # The session is shared between users, so the token travels per request
+    if token:
+        headers["Authorization"] = f"token {token}"
+
+    for attempt in range(GITHUB_RATE_LIMIT_RETRIES + 1):
+        response = acquire_github_response(url, headers, stream)
+        wait = rate_limit_wait(response, attempt)
+        # Waits beyond the cap (e.g. an exhausted quota) are surfaced to the user instead of held in a worker
+        if wait is None or wait > GITHUB_RATE_LIMIT_MAX_WAIT or attempt == GITHUB_RATE_LIMIT_RETRIES:
+            return response
+        response.close()
+        time.sleep(wait + random.uniform(0, 0.5))
+
+def github_get_conditional(url, parse, token=None, stream=False):
+    """GETs url with If-None-Match from the on-disk ETag cache; returns (status_code, parse(response))."""
+    # Scoped to the token so one user's private data is never served to another, and to the parser
+    # so a stored value always has the shape the caller expects
+    cache_key = hashlib.sha256(f"{token or ''}\n{parse.__name__}\n{url}".encode("utf-8")).hexdigest()
+    cached = read_disk_cache("etags", cache_key)
+    headers = {"If-None-Match": cached[0]} if cached else None
+
+    with github_get(url, token, stream=stream, headers=headers) as response:
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+        value = parse(response)
+
+    etag = response.headers.get("ETag")
+    if response.status_code == 200 and etag:
+        write_disk_cache("etags", cache_key, (etag, value))
+    return response.status_code, value
+
+@st.cache_resource
+def get_genai_state():
+    """Tracks which API key the process-wide Gemini SDK is currently configured with."""
+    return {"api_key": None, "lock": threading.Lock()}
+
+@contextmanager
+def configured_genai(api_key):
+    """Holds the process-wide Gemini SDK on api_key for the block; reconfigures only when the key changes."""
+    state = get_genai_state()
+    # genai.configure is global, so the key must stay put until the SDK call in the block has bound its client
+    with state["lock"]:
+        if state["api_key"] != api_key:
+            genai.configure(api_key=api_key)
+            state["api_key"] = api_key
+        yield
+
+def api_key_digest(api_key):
+    """Stands in for the API key in cache keys and session state so the key itself is never stored there."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+def get_available_models(api_key, full_list=False):
+    """Returns the models to offer; the full list_models() listing only when asked for or when the probe fails."""
+    key_digest = api_key_digest(api_key)
+    try:
+        if not full_list and probe_default_model(key_digest, _api_key=api_key):
+            return PREFERRED_MODELS
+        return list_generation_models(key_digest, _api_key=api_key)
+    except Exception:
+        # Transient failures (network, 5xx) are raised past the caches, so the next rerun tries again
+        return []
+
+@st.cache_data(ttl=600, show_spinner=False)
+def probe_default_model(key_digest, _api_key):
+    """Checks that the key can use the default model (get_model makes a cheap count_tokens call)."""
+    try:
+        get_model(_api_key, PREFERRED_MODELS[0])
+        return True
+    except google_exceptions.ClientError:
+        # Only a rejection (bad key, unknown model) is a cacheable answer; other errors propagate uncached
+        return False
+
+@st.cache_data(ttl=600, show_spinner=False)
+def list_generation_models(key_digest, _api_key):
+    """Lists the models that support generateContent for the given key."""
     try:
-        genai.configure(api_key=api_key)
         models = []
-        for m in genai.list_models():
-            # Only consider text-capable models for this task
-            if 'generateContent' in m.supported_generation_methods:
-                models.append(m.name)
+        # list_models() pages lazily, so it is fully consumed while the key is held
+        with configured_genai(_api_key):
+            for m in genai.list_models():
+                # Only consider text-capable models for this task
+                if 'generateContent' in m.supported_generation_methods:
+                    models.append(m.name)
         return models
-    except Exception as e:
-        # st.error(f"Error fetching models: {e}") # Suppress error in helper
+    except google_exceptions.ClientError:
+        # A rejected key is cached as "no models"; transient errors propagate so they are not cached
         return []
 
 def parse_github_url(url):
@@ -39,130 +298,426 @@ def parse_github_url(url):
     except:
         return None, None
 
-def fetch_file_content(owner, repo, file_path, token=None):
-    """Fetches the content of a specific file using the GitHub Content API."""
-    headers = {}
-    if token:
-        headers["Authorization"] = f"token {token}"
-        
-    file_url = f"https://api.github.com/repos/{owner}/{repo}/contents/{file_path}"
-    response = requests.get(file_url, headers=headers)
-    
+class GitHubFetchError(Exception):
+    """Raised when a GitHub request fails for any reason other than the resource not existing."""
+
+# Statuses that mean "not there" rather than "could not fetch" (409: empty repository has no tree)
+GITHUB_MISSING_STATUSES = (404, 409)
+
+def decode_base64_content(content_b64):
+    """Decodes the newline-wrapped base64 returned by the GitHub Content and Blobs APIs."""
+    raw = content_b64.replace("\n", "").encode("ascii")
+    if pybase64 is not None and len(raw) > PYBASE64_MIN_BYTES:
+        return pybase64.b64decode(raw)
+    return binascii.a2b_base64(raw)
+
+def decode_file_response(response, file_path):
+    """Decodes a Content or Blobs API response into the file's capped text, or None if the file does not exist."""
+    if response.status_code not in (200, *GITHUB_MISSING_STATUSES):
+        raise GitHubFetchError(f"{file_path}: HTTP {response.status_code}")
     if response.status_code == 200:
         content_b64 = response.json().get('content', '')
         try:
-            return base64.b64decode(content_b64).decode('utf-8')
-        except:
+            # Capped before anything is cached, so multi-MB lock files are never kept in full
+            return cap_file_content(file_path, decode_base64_content(content_b64).decode('utf-8'))
+        except ValueError:
             return f"Error decoding {file_path} content."
-    return f"File {file_path} not found or inaccessible."
+    return None
+
+def fetch_file_content(owner, repo, file_path, token=None, sha=None):
+    """Fetches a file by blob SHA (Git Blobs API) or path (Content API); None if missing, GitHubFetchError if the fetch fails."""
+    try:
+        if sha:
+            # Blobs are content-addressed, so a stored copy never goes stale and needs no request until it expires
+            content = read_disk_cache("blobs", sha)
+            if content is None:
+                file_url = f"https://api.github.com/repos/{owner}/{repo}/git/blobs/{sha}"
+                response = github_get(file_url, token)
+                content = decode_file_response(response, file_path)
+                if response.status_code == 200:
+                    write_disk_cache("blobs", sha, content)
+            return content
+
+        file_url = f"https://api.github.com/repos/{owner}/{repo}/contents/{file_path}"
+        _, content = github_get_conditional(file_url, lambda r: decode_file_response(r, file_path), token)
+        return content
+    except (requests.RequestException, Urllib3HTTPError) as e:
+        raise GitHubFetchError(f"{file_path}: {e}") from e
+
+def fetch_files_via_tarball(owner, repo, branch, file_names, token=None):
+    """Downloads the branch tarball once and returns the requested root-level files (capped), or None on failure."""
+    tarball_url = f"https://api.github.com/repos/{owner}/{repo}/tarball/{branch}"
+    try:
+        with github_get(tarball_url, token, stream=True) as response:
+            if response.status_code != 200:
+                return None
+            contents = {}
+            # Members are read in memory and never extracted, so archive paths cannot escape anywhere
+            with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                for member in archive:
+                    # Archive entries are prefixed with a single "<owner>-<repo>-<sha>/" directory
+                    parts = member.name.split("/")
+                    if len(parts) != 2 or parts[1] not in file_names or not member.isfile():
+                        continue
+                    try:
+                        contents[parts[1]] = cap_file_content(parts[1], archive.extractfile(member).read().decode('utf-8'))
+                    except UnicodeDecodeError:
+                        contents[parts[1]] = f"Error decoding {parts[1]} content."
+            return contents
+    except (requests.RequestException, Urllib3HTTPError, tarfile.TarError):
+        # response.raw is read directly, so mid-stream failures surface as urllib3 errors rather than requests ones
+        return None
+
+def iter_tree_items(response):
+    """Yields tree entries as they are parsed."""
+    if ijson is None:
+        yield from response.json().get('tree', [])
+        return
+
+    # Parse straight off the socket so a huge tree is never held in memory as one document
+    response.raw.decode_content = True
+    yield from ijson.items(response.raw, "tree.item")
 
+def parse_tree_paths(response):
+    """Returns the first STRUCTURE_MAX_FILES paths of a recursive tree without parsing the rest, or None if missing."""
+    if response.status_code in GITHUB_MISSING_STATUSES:
+        return None
+    if response.status_code != 200:
+        raise GitHubFetchError(f"tree: HTTP {response.status_code}")
+    return [item['path'] for item in itertools.islice(iter_tree_items(response), STRUCTURE_MAX_FILES)]
+
+def parse_root_tree(response):
+    """Maps README.md and the dependency files at the repo root to their blob SHAs, or None if unavailable."""
+    if response.status_code in GITHUB_MISSING_STATUSES:
+        return None
+    if response.status_code != 200:
+        raise GitHubFetchError(f"root tree: HTTP {response.status_code}")
+    tree_data = response.json()
+    # A truncated tree may be missing root files, so only trust it when complete
+    if tree_data.get('truncated'):
+        return None
+    return {
+        item['path']: item['sha']
+        for item in tree_data.get('tree', [])
+        if item['path'] in REPO_FILES and item.get('type') == 'blob'
+    }
+
+class RepoFetchError(Exception):
+    """Raised inside the cached repo fetch so errors are reported but never cached."""
+
+class IncompleteRepoData(Exception):
+    """Carries a partially fetched repo out of the cached fetch so it is used once but never cached."""
+
+    def __init__(self, repo_data):
+        super().__init__("Some repository files could not be fetched.")
+        self.repo_data = repo_data
 
 def get_repo_structure(owner, repo, token=None):
-    """Fetches metadata, file tree, README, and dependency files (V1 feature)."""
-    headers = {}
-    if token:
-        headers["Authorization"] = f"token {token}"
-    
-    # 1. Get Repository Metadata
+    """Fetches metadata, file tree, README, and dependency files (V1 feature); returns (repo_data, error)."""
+    try:
+        return fetch_repo_structure(owner, repo, token), None
+    except IncompleteRepoData as e:
+        return e.repo_data, None
+    except RepoFetchError as e:
+        return None, str(e)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_repo_structure(owner, repo, token=None):
+    """Cached body of get_repo_structure; only complete results are cached."""
+    executor = get_github_executor()
+
+    def submit_tree(branch):
+        # The recursive tree only feeds the structure listing and is cut off after STRUCTURE_MAX_FILES paths;
+        # the blob SHAs come from the small non-recursive root tree, which is always read in full
+        tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{branch}"
+        return (
+            executor.submit(github_get_conditional, f"{tree_url}?recursive=1", parse_tree_paths, token, True),
+            executor.submit(github_get_conditional, tree_url, parse_root_tree, token),
+        )
+
+    # Set when something that exists could not be fetched, as opposed to simply not being there
+    incomplete = False
+
+    def tree_result(future):
+        try:
+            return future.result()[1], False
+        except (requests.RequestException, Urllib3HTTPError, GitHubFetchError):
+            # The recursive tree is parsed straight off response.raw, so read timeouts surface as urllib3 errors
+            return None, True
+
+    # 1. & 2. Get Repository Metadata and, speculatively, the File Trees of "main" at the same time;
+    # most repos default to "main", which takes the tree requests off the critical path
     api_url = f"https://api.github.com/repos/{owner}/{repo}"
-    response = requests.get(api_url, headers=headers)
-    
-    if response.status_code != 200:
-        error_message = response.json().get('message', 'Unknown error')
-        return None, f"Error: Could not fetch repo. Status Code: {response.status_code}. Message: {error_message}"
+    metadata_future = executor.submit(github_get_conditional, api_url, lambda r: r.json(), token)
+    main_tree_futures = submit_tree("main")
+
+    try:
+        status_code, repo_data = metadata_future.result()
+    except requests.RequestException as e:
+        for future in main_tree_futures:
+            future.cancel()
+        raise RepoFetchError(f"Error: Could not fetch repo. Message: {e}")
+    if status_code != 200:
+        for future in main_tree_futures:
+            future.cancel()
+        error_message = repo_data.get('message', 'Unknown error')
+        raise RepoFetchError(f"Error: Could not fetch repo. Status Code: {status_code}. Message: {error_message}")
     
-    repo_data = response.json()
     default_branch = repo_data.get("default_branch", "main")
-    
-    # 2. Get File Tree (Recursive)
-    tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{default_branch}?recursive=1"
-    tree_response = requests.get(tree_url, headers=headers)
-    
-    file_structure = ""
-    if tree_response.status_code == 200:
-        tree_data = tree_response.json()
-        files = [item['path'] for item in tree_data.get('tree', [])[:100]] 
-        file_structure = "\n".join(files)
-
-    # 3. Get README.md content 
-    readme_content = fetch_file_content(owner, repo, "README.md", token)
-    if "not found" in readme_content or "inaccessible" in readme_content:
-        readme_content = "No README.md found."
-    
-    # 4. Dependency File Fetching (V1 feature)
+    tree_futures = main_tree_futures
+    if default_branch != "main":
+        for future in main_tree_futures:
+            future.cancel()
+        tree_futures = submit_tree(default_branch)
+
+    files, incomplete = tree_result(tree_futures[0])
+    file_structure = "\n".join(files) if files else ""
+    # Without root SHAs the files are still fetched by path below, so a failure here alone loses nothing
+    blob_shas, _ = tree_result(tree_futures[1])
+
+    # 3. & 4. Fetch README.md and dependency files (V1 feature) concurrently
     dependency_content = {}
-    dep_files = ["requirements.txt", "package.json", "Pipfile", "pyproject.toml", "package-lock.json", "Pipfile.lock", "yarn.lock"]
-    
-    for file_name in dep_files:
-        content = fetch_file_content(owner, repo, file_name, token)
-        if "not found" not in content and "inaccessible" not in content:
+    wanted_files = REPO_FILES
+    results = {}
+
+    if blob_shas is not None:
+        # The tree already tells us which files exist; skip the rest instead of paying for 404s
+        wanted_files = [f for f in wanted_files if f in blob_shas]
+        # Blobs fetched by an earlier analysis are served straight from disk
+        for file_name in wanted_files:
+            content = read_disk_cache("blobs", blob_shas[file_name])
+            if content is not None:
+                results[file_name] = content
+        wanted_files = [f for f in wanted_files if f not in results]
+    else:
+        blob_shas = {}
+
+    fetched = None
+    if repo_data.get("size", 0) <= TARBALL_MAX_REPO_KB and len(wanted_files) > 1:
+        # Small repo: one archive download beats a round trip per file
+        fetched = fetch_files_via_tarball(owner, repo, default_branch, wanted_files, token)
+        for file_name, content in (fetched or {}).items():
+            if file_name in blob_shas:
+                write_disk_cache("blobs", blob_shas[file_name], content)
+
+    if fetched is None:
+        failed_files = []
+
+        def fetch_one(file_name):
+            try:
+                return file_name, fetch_file_content(owner, repo, file_name, token, blob_shas.get(file_name))
+            except GitHubFetchError:
+                failed_files.append(file_name)
+                return file_name, None
+
+        fetched = dict(executor.map(fetch_one, wanted_files))
+        incomplete = incomplete or bool(failed_files)
+    results.update(fetched)
+
+    readme_content = results.get("README.md")
+    if readme_content is None:
+        readme_content = "No README.md found."
+
+    for file_name in DEPENDENCY_FILES:
+        content = results.get(file_name)
+        if content is not None:
             dependency_content[file_name] = content
             
     if not dependency_content:
         dependency_content["status"] = "No primary dependency file (e.g., requirements.txt, package.json) or lock file found."
 
-    return {
+    result = {
         "metadata": repo_data,
         "structure": file_structure,
         "readme": readme_content,
-        "dependencies": dependency_content 
-    }, None
+        "dependencies": dependency_content,
+        # A failed fetch reads like a missing file to the model, so such results must not be cached as final
+        "incomplete": incomplete,
+    }
+    if incomplete:
+        raise IncompleteRepoData(result)
+    return result
+
+@st.cache_resource
+def get_cache_lock():
+    """Serialises access to the shelve files, which are not safe for concurrent writers."""
+    return threading.Lock()
+
+def disk_cache_entry_age(entry):
+    """Returns how old a stored entry is; entries without a timestamp count as expired."""
+    if not isinstance(entry, dict) or "stored_at" not in entry:
+        return float("inf")
+    return time.time() - entry["stored_at"]
+
+def read_disk_cache(name, key):
+    """Returns the value stored under key in the named on-disk cache, or None if missing or expired."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with get_cache_lock(), shelve.open(os.path.join(CACHE_DIR, name)) as db:
+        entry = db.get(key)
+        if entry is None:
+            return None
+        if disk_cache_entry_age(entry) > DISK_CACHE_TTL:
+            del db[key]
+            return None
+        return entry["value"]
+
+def write_disk_cache(name, key, value):
+    """Stores value under key in the named on-disk cache, pruning the store when it grows too large."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with get_cache_lock(), shelve.open(os.path.join(CACHE_DIR, name)) as db:
+        db[key] = {"stored_at": time.time(), "value": value}
+        if len(db) > DISK_CACHE_MAX_ENTRIES:
+            # Drop expired entries, then the oldest, down to three quarters of the cap
+            ages = sorted(((disk_cache_entry_age(db[k]), k) for k in list(db.keys())), reverse=True)
+            excess = len(ages) - DISK_CACHE_MAX_ENTRIES * 3 // 4
+            for index, (age, stale_key) in enumerate(ages):
+                if index >= excess and age <= DISK_CACHE_TTL:
+                    break
+                del db[stale_key]
+
+def analysis_cache_key(repo_data, model_name):
+    """Keys an analysis on the repo, its last push and the model, so stars, forks or issues alone don't re-run it."""
+    metadata = repo_data['metadata']
+    # Editing the instructions or template changes what the model sees, so it invalidates old entries
+    prompt_digest = hashlib.sha256(f"{SYSTEM_INSTRUCTION}\n{PROMPT_TEMPLATE.template}".encode("utf-8")).hexdigest()
+    key = f"{metadata.get('full_name')}\n{metadata.get('pushed_at')}\n{model_name}\n{prompt_digest}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
-def analyze_with_gemini(repo_data, api_key, model_name):
-    """Sends repo data to Gemini for analysis with enhanced Dependency Check (V1 prompt)."""
+def slim_metadata(metadata):
+    """Keeps only the repository metadata fields relevant to the evaluation."""
+    slim = {field: metadata.get(field) for field in METADATA_FIELDS}
+    if isinstance(slim["license"], dict):
+        slim["license"] = slim["license"].get("spdx_id") or slim["license"].get("name")
+    return slim
+
+def summarize_lock_file(file_name, content):
+    """Reduces a lock file to its pinned package list; returns the content unchanged if it cannot be parsed."""
     try:
-        genai.configure(api_key=api_key) 
-        model = genai.GenerativeModel(model_name) 
-    except Exception as e:
-         return f"Error configuring Gemini API or loading model: {e}"
+        if file_name == "package-lock.json":
+            lock = json.loads(content)
+            root = lock.get("packages", {}).get("", {})
+            direct = {**root.get("dependencies", {}), **root.get("devDependencies", {})}
+            if direct:
+                # lockfileVersion 2/3: resolve the root package's direct dependencies
+                packages = lock.get("packages", {})
+                lines = [f"{name}@{packages.get(f'node_modules/{name}', {}).get('version', spec)}" for name, spec in direct.items()]
+            else:
+                # lockfileVersion 1: top-level dependencies map
+                lines = [f"{name}@{info.get('version', '?')}" for name, info in lock.get("dependencies", {}).items()]
+        elif file_name == "Pipfile.lock":
+            lock = json.loads(content)
+            lines = [
+                f"{name}{info.get('version', '')}"
+                for section in ("default", "develop")
+                for name, info in lock.get(section, {}).items()
+            ]
+        elif file_name == "yarn.lock":
+            lines = []
+            for header, version in re.findall(r'^([^\s#][^\n]*):\n\s+version:? "?([^"\n]+)"?', content, re.M):
+                # '"@scope/pkg@^1.0.0", "@scope/pkg@^1.2.0"' -> '@scope/pkg'
+                spec = header.split(",")[0].strip().strip('"')
+                name = spec[:spec.rfind("@")] if spec.rfind("@") > 0 else spec
+                lines.append(f"{name}@{version}")
+        else:
+            return content
+    except (ValueError, AttributeError, TypeError):
+        # Malformed lock files (wrong JSON shapes included) are passed through rather than failing the fetch
+        return content
+    return "\n".join(lines) if lines else content
+
+def truncate_text(text, max_bytes):
+    """Cuts text to at most max_bytes of UTF-8, marker included, so the model knows content is missing."""
+    encoded = text.encode("utf-8")
+    if len(encoded) <= max_bytes:
+        return text
+    keep = max(max_bytes - len(TRUNCATION_MARKER.encode("utf-8")), 0)
+    return encoded[:keep].decode("utf-8", "ignore") + TRUNCATION_MARKER
+
+def cap_file_content(file_name, content):
+    """Shrinks a fetched file to its per-file byte cap, summarizing lock files first."""
+    if file_name in LOCK_FILES:
+        content = summarize_lock_file(file_name, content)
+    max_bytes = README_MAX_BYTES if file_name == "README.md" else DEPENDENCY_FILE_MAX_BYTES
+    return truncate_text(content, max_bytes)
 
+def format_dependencies(dependencies, budget=DEPENDENCY_BYTE_BUDGET):
+    """Formats dependency files for the prompt, capping the total UTF-8 size at budget bytes."""
+    separator = "\n\n"
+    sections = []
+    remaining = budget
+    # Manifests first: they are small and carry the declared version ranges
+    for name in sorted(dependencies, key=lambda n: n in LOCK_FILES):
+        if sections:
+            remaining -= len(separator)
+        # Stop once there is no room left for more than a truncation marker
+        if remaining <= len(TRUNCATION_MARKER):
+            break
+        section = truncate_text(f"--- {name} ---\n{dependencies[name]}", remaining)
+        sections.append(section)
+        remaining -= len(section.encode("utf-8"))
+    return separator.join(sections)
+
+@st.cache_resource(show_spinner=False)
+def get_model(api_key, model_name):
+    """Returns a GenerativeModel bound to api_key, built once per key and model."""
+    with configured_genai(api_key):
+        model = genai.GenerativeModel(model_name, system_instruction=SYSTEM_INSTRUCTION)
+        # The model picks up the active client on its first call; make it now, before another key can be configured
+        model.count_tokens("ping")
+    return model
+
+def build_analysis_prompt(repo_data):
+    """Builds the evaluation prompt with enhanced Dependency Check (V1 prompt)."""
     # Format Dependency Data for the Prompt
-    dep_summary = "\n\n".join([
-        f"--- {name} ---\n{content}" for name, content in repo_data['dependencies'].items()
-    ])
+    dep_summary = format_dependencies(repo_data['dependencies'])
+    metadata_summary = json.dumps(slim_metadata(repo_data['metadata']), separators=(',', ':'))
 
-    # Construct the comprehensive prompt
-    prompt = f"""
-    You are a strict Senior Developer Mentor acting as an AI engine for "GitGrade".
-    Your task is to evaluate a GitHub repository based on the following inputs:
-    
-    1. **Repository Metadata**: {repo_data['metadata']}
-    2. **File Structure**: 
-    {repo_data['structure']}
-    3. **README Content**: 
-    {repo_data['readme']}
-    4. **Dependency Files Content**:
-    {dep_summary}
+    return PROMPT_TEMPLATE.substitute(
+        metadata=metadata_summary,
+        structure=repo_data['structure'],
+        readme=repo_data['readme'],
+        deps=dep_summary,
+    )
 
-    **Evaluation Criteria:**
-    - **Code Quality & Organization:** Look for clean folder structures (src, tests, docs), separation of concerns.
-    - **Documentation:** Is the README clear? Does it have setup instructions?
-    - **Best Practices:** Presence of .gitignore, LICENSE, CI/CD workflows, test folders.
-    - **Dependency Health (CRITICAL):** Analyze the provided dependency content (or lack thereof) for:
-        a) **Security Risk:** Are common packages severely outdated? (Infer potential CVEs if versions are very old).
-        b) **Maintainability:** Is a lock file (e.g., package-lock.json, Pipfile.lock) present? (Crucial for reproducible builds).
-        c) **Clarity:** Are dependencies specified without version pinning? (Bad practice).
+def stream_gemini_response(model, prompt, cache_key):
+    """Yields the response text chunk by chunk, caching the full text once generation completes (unless cache_key is None)."""
+    chunks = []
+    try:
+        for chunk in model.generate_content(prompt, stream=True):
+            chunks.append(chunk.text)
+            yield chunk.text
+    except Exception as e:
+        yield f"Error generating content: {e}"
+        return
+    if cache_key is not None:
+        write_disk_cache("analyses", cache_key, "".join(chunks))
 
-    **Output Requirement:**
-    Provide the response in the following specific format:
+def analyze_with_gemini(repo_data, api_key, model_name, stream=False):
+    """Sends repo data to Gemini for analysis. With stream=True, returns an iterator of text chunks."""
+    prompt = build_analysis_prompt(repo_data)
 
-    ### SCORE
-    [Provide a score out of 100 based on the quality. Be honest and critical.]
+    # Keyed on pushed_at rather than the prompt, so a repo is only re-analyzed after new commits
+    cache_key = analysis_cache_key(repo_data, model_name)
+    cached_text = read_disk_cache("analyses", cache_key)
+    if cached_text is not None:
+        return iter([cached_text]) if stream else cached_text
+    if repo_data.get('incomplete'):
+        # Don't let a transient GitHub failure become everyone's grade until the next push
+        cache_key = None
 
-    ### CRITICAL INSIGHTS
-    [A 2-3 sentence section dedicated ONLY to Dependency Health and Security Risk. Be direct.]
+    try:
+        model = get_model(api_key, model_name)
+    except Exception as e:
+        error = f"Error configuring Gemini API or loading model: {e}"
+        return iter([error]) if stream else error
 
-    ### SUMMARY
-    [A short paragraph (approx 50 words) evaluating the strengths and weaknesses of the overall project, including the Dependency Health findings.]
+    if stream:
+        return stream_gemini_response(model, prompt, cache_key)
 
-    ### ROADMAP
-    [Bulleted list of 3-5 actionable steps the student must take to improve this project. Include at least two specific actions related to Dependency Health (e.g., pinning versions, adding a lock file, or updating a specific package).]
-    
-    Do not be polite just for the sake of it. Give honest, constructive feedback.
-    """
-    
     try:
         response = model.generate_content(prompt)
+        if cache_key is not None:
+            write_disk_cache("analyses", cache_key, response.text)
         return response.text
     except Exception as e:
         return f"Error generating content: {e}"
@@ -178,8 +733,23 @@ with st.sidebar:
     
     # 2. Dynamic Dropdown (Only appears if Key is valid)
     if gemini_api_key:
+        key_digest = api_key_digest(gemini_api_key)
+        # A new key starts back on the cheap probe rather than inheriting the previous key's full listing
+        if st.session_state.get("model_key_digest") != key_digest:
+            st.session_state["model_key_digest"] = key_digest
+            st.session_state["full_model_list"] = False
+
+        # The full listing is only fetched on request; the preferred models cover most users
+        if st.button("Refresh model list"):
+            # Clear only this key's entries so other users' cached listings survive
+            list_generation_models.clear(key_digest, _api_key=gemini_api_key)
+            probe_default_model.clear(key_digest, _api_key=gemini_api_key)
+            st.session_state["full_model_list"] = True
+
         with st.spinner("Fetching available models..."):
-            available_models = get_available_models(gemini_api_key)
+            available_models = get_available_models(
+                gemini_api_key, full_list=st.session_state.get("full_model_list", False)
+            )
         
         if available_models:
             # Prefer 'flash' model for performance
@@ -234,10 +804,8 @@ if st.button("Analyze Repository"):
                 st.error(error)
             else:
                 st.success("Repository data fetched! Analyzing with Gemini AI...")
-                
-                with st.spinner(f"Generating Score, Summary, and Roadmap using **{selected_model.split('/')[-1]}**..."):
-                    # Pass the selected model name to the analysis function
-                    analysis = analyze_with_gemini(repo_data, gemini_api_key, selected_model)
+                if repo_data.get('incomplete'):
+                    st.warning("Some files could not be fetched from GitHub, so this analysis may be incomplete. Try again shortly.")
                 
                 # --- DISPLAY RESULTS ---
                 st.markdown("---")
@@ -250,8 +818,9 @@ if st.button("Analyze Repository"):
                     st.metric(label="Stars", value=repo_data['metadata'].get('stargazers_count', 0))
                 
                 with col2:
-                    # Display the full analysis including CRITICAL INSIGHTS
-                    st.markdown(analysis)
+                    # Stream the full analysis including CRITICAL INSIGHTS as it is generated
+                    with st.spinner(f"Generating Score, Summary, and Roadmap using **{selected_model.split('/')[-1]}**..."):
+                        st.write_stream(analyze_with_gemini(repo_data, gemini_api_key, selected_model, stream=True))
 
 # --- FOOTER ---
 st.markdown("---")